@@ -1,4 +1,12 @@
 // Game class for Isometric RTS Game
+
+// Troop type names and shapes, indexed by the type id sent by the server
+const TROOP_TYPES = ['soldier', 'knight', 'archer'];
+const TROOP_SHAPES = ['circle', 'triangle', 'square'];
+
+// Largest value of the uint16 positions sent by the server, which spans the map
+const POSITION_SCALE = 65535;
+
 class Game {
     constructor(canvasId) {
         this.renderer = new Renderer(canvasId);
@@ -9,6 +17,7 @@ class Game {
         this.selectionStart = { x: 0, y: 0 };
         this.selectionEnd = { x: 0, y: 0 };
         this.gameState = null;
+        this.troopInfo = new Map(); // Static troop fields by troop id
     }
 
     set_player_id(playerId) {
@@ -16,7 +25,66 @@ class Game {
         this.renderer.setPlayerId(playerId);
     }
 
-    update_game_state(state) {
+    update_game_state(update) {
+        // Apply static troop fields from the delta (or replace them on a keyframe)
+        if (update.keyframe) {
+            this.troopInfo.clear();
+        }
+        const colors = new Map(update.players.map(p => [p.id, p.color]));
+        const added = update.add;
+        for (let i = 0; i < added.id.length; i++) {
+            const typeId = added.type_id[i];
+            this.troopInfo.set(added.id[i], {
+                id: added.id[i],
+                player_id: added.player_id[i],
+                color: colors.get(added.player_id[i]),
+                type: TROOP_TYPES[typeId],
+                shape: TROOP_SHAPES[typeId]
+            });
+        }
+        for (const id of update.remove) {
+            this.troopInfo.delete(id);
+        }
+        
+        // Rebuild the troop list from the packed per-troop arrays: positions
+        // are uint16 fractions of the map, directions are int8 scaled by 127
+        // and health is a uint8
+        const scaleX = update.map_size[0] / POSITION_SCALE;
+        const scaleY = update.map_size[1] / POSITION_SCALE;
+        const ids = update.ids;
+        const positions = update.pos;
+        const directions = update.dir;
+        const health = update.health;
+        const troops = [];
+        for (let i = 0; i < ids.length; i++) {
+            const info = this.troopInfo.get(ids[i]);
+            if (!info) continue; // Static fields arrive with the next keyframe
+            troops.push({
+                ...info,
+                position: [positions[2 * i] * scaleX, positions[2 * i + 1] * scaleY],
+                direction: [directions[2 * i] / 127, directions[2 * i + 1] / 127],
+                health: health[i]
+            });
+        }
+        
+        // Rebuild the projectile list, colored by the owning player
+        const projPlayerIds = update.proj_player_id;
+        const projPositions = update.proj_pos;
+        const projectiles = [];
+        for (let i = 0; i < projPlayerIds.length; i++) {
+            projectiles.push({
+                player_id: projPlayerIds[i],
+                position: [projPositions[2 * i] * scaleX, projPositions[2 * i + 1] * scaleY],
+                color: colors.get(projPlayerIds[i])
+            });
+        }
+        
+        const state = {
+            players: update.players,
+            map_size: update.map_size,
+            troops,
+            projectiles
+        };
         this.gameState = state;
         this.renderer.updateGameState(state);
     }
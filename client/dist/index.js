@@ -32,8 +32,8 @@
         
         updateLoadingProgress(10, 'Connecting to server...');
         
-        // Connect to the server
-        socket = io();
+        // Connect to the server, speaking MessagePack like the server does
+        socket = io({ parser: msgpackParser });
         
         // Socket.IO event handlers
         socket.on('connect', () => {
@@ -0,0 +1,290 @@
+// MessagePack parser for the Socket.IO client, matching the server's msgpack serializer
+(function() {
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    // Typed array constructors for the NumPy dtype strings written by msgpack_numpy
+    const NUMPY_TYPES = {
+        '|b1': Uint8Array,
+        '|u1': Uint8Array,
+        '|i1': Int8Array,
+        '<u2': Uint16Array,
+        '<i2': Int16Array,
+        '<u4': Uint32Array,
+        '<i4': Int32Array,
+        '<f4': Float32Array,
+        '<f8': Float64Array
+    };
+
+    // Convert a decoded msgpack_numpy map into a flat typed array (or a number
+    // for NumPy scalars); the data bytes own their buffer so no copy is needed
+    function decodeNumpy(obj) {
+        const ArrayType = NUMPY_TYPES[obj.type];
+        if (!ArrayType) {
+            throw new Error(`Unsupported NumPy dtype ${obj.type}`);
+        }
+        const array = new ArrayType(obj.data.buffer);
+        return obj.nd ? array : array[0];
+    }
+
+    // Encode a value as MessagePack, returning a Uint8Array
+    function encode(value) {
+        let bytes = new Uint8Array(256);
+        let view = new DataView(bytes.buffer);
+        let offset = 0;
+
+        function reserve(size) {
+            if (offset + size <= bytes.length) return;
+            let length = bytes.length * 2;
+            while (length < offset + size) length *= 2;
+            const grown = new Uint8Array(length);
+            grown.set(bytes);
+            bytes = grown;
+            view = new DataView(bytes.buffer);
+        }
+
+        function writeUint8(x) { reserve(1); view.setUint8(offset, x); offset += 1; }
+        function writeUint16(x) { reserve(2); view.setUint16(offset, x); offset += 2; }
+        function writeUint32(x) { reserve(4); view.setUint32(offset, x); offset += 4; }
+        function writeBytes(data) { reserve(data.length); bytes.set(data, offset); offset += data.length; }
+
+        // Write a type byte followed by an 8, 16 or 32 bit length
+        function writeHeader(length, type8, type16, type32) {
+            if (type8 !== null && length < 0x100) {
+                writeUint8(type8);
+                writeUint8(length);
+            } else if (length < 0x10000) {
+                writeUint8(type16);
+                writeUint16(length);
+            } else {
+                writeUint8(type32);
+                writeUint32(length);
+            }
+        }
+
+        function writeNumber(x) {
+            if (Number.isInteger(x) && x >= 0 && x <= 0xffffffff) {
+                if (x < 0x80) {
+                    writeUint8(x);
+                } else if (x < 0x100) {
+                    writeUint8(0xcc);
+                    writeUint8(x);
+                } else if (x < 0x10000) {
+                    writeUint8(0xcd);
+                    writeUint16(x);
+                } else {
+                    writeUint8(0xce);
+                    writeUint32(x);
+                }
+            } else if (Number.isInteger(x) && x < 0 && x >= -0x80000000) {
+                if (x >= -0x20) {
+                    writeUint8(x & 0xff);
+                } else {
+                    writeUint8(0xd2);
+                    reserve(4);
+                    view.setInt32(offset, x);
+                    offset += 4;
+                }
+            } else {
+                writeUint8(0xcb);
+                reserve(8);
+                view.setFloat64(offset, x);
+                offset += 8;
+            }
+        }
+
+        function write(v) {
+            if (v === null || v === undefined) {
+                writeUint8(0xc0);
+            } else if (v === false) {
+                writeUint8(0xc2);
+            } else if (v === true) {
+                writeUint8(0xc3);
+            } else if (typeof v === 'number') {
+                writeNumber(v);
+            } else if (typeof v === 'string') {
+                const data = textEncoder.encode(v);
+                if (data.length < 0x20) {
+                    writeUint8(0xa0 | data.length);
+                } else {
+                    writeHeader(data.length, 0xd9, 0xda, 0xdb);
+                }
+                writeBytes(data);
+            } else if (v instanceof ArrayBuffer || ArrayBuffer.isView(v)) {
+                const data = v instanceof ArrayBuffer
+                    ? new Uint8Array(v)
+                    : new Uint8Array(v.buffer, v.byteOffset, v.byteLength);
+                writeHeader(data.length, 0xc4, 0xc5, 0xc6);
+                writeBytes(data);
+            } else if (Array.isArray(v)) {
+                if (v.length < 0x10) {
+                    writeUint8(0x90 | v.length);
+                } else {
+                    writeHeader(v.length, null, 0xdc, 0xdd);
+                }
+                for (const item of v) {
+                    write(item);
+                }
+            } else if (typeof v === 'object') {
+                const keys = Object.keys(v).filter(key => v[key] !== undefined);
+                if (keys.length < 0x10) {
+                    writeUint8(0x80 | keys.length);
+                } else {
+                    writeHeader(keys.length, null, 0xde, 0xdf);
+                }
+                for (const key of keys) {
+                    write(key);
+                    write(v[key]);
+                }
+            } else {
+                throw new Error(`Cannot encode ${typeof v} as MessagePack`);
+            }
+        }
+
+        write(value);
+        return bytes.slice(0, offset);
+    }
+
+    // Decode MessagePack from an ArrayBuffer or Uint8Array.
+    // Binary values are returned as Uint8Arrays with their own buffer, so
+    // typed array views can be created on them directly. NumPy arrays packed
+    // by msgpack_numpy are returned as typed arrays.
+    function decode(buffer) {
+        const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function readUint8() { const x = view.getUint8(offset); offset += 1; return x; }
+        function readUint16() { const x = view.getUint16(offset); offset += 2; return x; }
+        function readUint32() { const x = view.getUint32(offset); offset += 4; return x; }
+
+        function readString(length) {
+            const s = textDecoder.decode(bytes.subarray(offset, offset + length));
+            offset += length;
+            return s;
+        }
+
+        function readBinary(length) {
+            const data = bytes.slice(offset, offset + length);
+            offset += length;
+            return data;
+        }
+
+        function readExt(length) {
+            const type = view.getInt8(offset);
+            offset += 1;
+            return { type, data: readBinary(length) };
+        }
+
+        function readArray(length) {
+            const items = new Array(length);
+            for (let i = 0; i < length; i++) {
+                items[i] = read();
+            }
+            return items;
+        }
+
+        function readMap(length) {
+            const obj = {};
+            for (let i = 0; i < length; i++) {
+                // msgpack_numpy writes its keys as binary
+                let key = read();
+                if (key instanceof Uint8Array) {
+                    key = textDecoder.decode(key);
+                }
+                obj[key] = read();
+            }
+            return 'nd' in obj && 'type' in obj && 'data' in obj ? decodeNumpy(obj) : obj;
+        }
+
+        function read() {
+            const type = readUint8();
+            if (type < 0x80) return type;
+            if (type < 0x90) return readMap(type & 0x0f);
+            if (type < 0xa0) return readArray(type & 0x0f);
+            if (type < 0xc0) return readString(type & 0x1f);
+            if (type >= 0xe0) return type - 0x100;
+
+            let x;
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return readBinary(readUint8());
+                case 0xc5: return readBinary(readUint16());
+                case 0xc6: return readBinary(readUint32());
+                case 0xc7: return readExt(readUint8());
+                case 0xc8: return readExt(readUint16());
+                case 0xc9: return readExt(readUint32());
+                case 0xca: x = view.getFloat32(offset); offset += 4; return x;
+                case 0xcb: x = view.getFloat64(offset); offset += 8; return x;
+                case 0xcc: return readUint8();
+                case 0xcd: return readUint16();
+                case 0xce: return readUint32();
+                case 0xcf: x = Number(view.getBigUint64(offset)); offset += 8; return x;
+                case 0xd0: x = view.getInt8(offset); offset += 1; return x;
+                case 0xd1: x = view.getInt16(offset); offset += 2; return x;
+                case 0xd2: x = view.getInt32(offset); offset += 4; return x;
+                case 0xd3: x = Number(view.getBigInt64(offset)); offset += 8; return x;
+                case 0xd4: return readExt(1);
+                case 0xd5: return readExt(2);
+                case 0xd6: return readExt(4);
+                case 0xd7: return readExt(8);
+                case 0xd8: return readExt(16);
+                case 0xd9: return readString(readUint8());
+                case 0xda: return readString(readUint16());
+                case 0xdb: return readString(readUint32());
+                case 0xdc: return readArray(readUint16());
+                case 0xdd: return readArray(readUint32());
+                case 0xde: return readMap(readUint16());
+                case 0xdf: return readMap(readUint32());
+            }
+            throw new Error(`Invalid MessagePack type 0x${type.toString(16)}`);
+        }
+
+        return read();
+    }
+
+    // Socket.IO parser interface: each packet is a single MessagePack message
+    class Encoder {
+        encode(packet) {
+            return [encode(packet)];
+        }
+    }
+
+    class Decoder {
+        constructor() {
+            this.listeners = {};
+        }
+
+        on(event, listener) {
+            (this.listeners[event] = this.listeners[event] || []).push(listener);
+            return this;
+        }
+
+        off(event, listener) {
+            const listeners = this.listeners[event] || [];
+            this.listeners[event] = listener ? listeners.filter(l => l !== listener) : [];
+            return this;
+        }
+
+        add(chunk) {
+            if (typeof chunk === 'string') {
+                throw new Error('Unexpected text packet');
+            }
+            const packet = decode(chunk);
+            if (!Number.isInteger(packet.type) || typeof packet.nsp !== 'string') {
+                throw new Error('Invalid packet');
+            }
+            for (const listener of this.listeners.decoded || []) {
+                listener(packet);
+            }
+        }
+
+        destroy() {
+            this.listeners = {};
+        }
+    }
+
+    window.msgpackParser = { protocol: 5, Encoder, Decoder, encode, decode };
+})();
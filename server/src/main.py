@@ -1,12 +1,18 @@
 import asyncio
 import json
+import math
+import msgpack
+import msgpack_numpy
 import numpy as np
 import socketio
 import uvicorn
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
+from numba import njit
+from socketio.msgpack_packet import MsgPackPacket
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -20,20 +26,379 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Socket.IO server
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+# Socket.IO MessagePack packets that write NumPy arrays as typed binary blobs
+class NumpyMsgPackPacket(MsgPackPacket):
+    def encode(self):
+        """Encode the packet, packing arrays with msgpack_numpy"""
+        return msgpack.dumps(self._to_dict(), default=msgpack_numpy.encode)
+
+# Initialize Socket.IO server, using MessagePack so arrays go out as raw binary
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*',
+                           serializer=NumpyMsgPackPacket)
 socket_app = socketio.ASGIApp(sio, app)
 
+# Spatial grid cell size: melee cells cover the 15 unit collision radius
+MELEE_CELL_SIZE = 16
+
+# Fixed simulation step rate and client broadcast rate, in Hz
+SIM_TICK_RATE = 60
+BROADCAST_RATE = 20
+
+# Most simulation steps run per wakeup; any further backlog is dropped so a
+# stall can't snowball into ever longer catch-up bursts
+MAX_SIM_STEPS = 5
+
+# Game updates between full keyframes sent to all clients (3 seconds)
+KEYFRAME_INTERVAL = 60
+
+# Compact troop storage once dead rows make up this fraction of it
+COMPACT_DEAD_FRACTION = 0.25
+
+# Troop rows per tile when checking projectile hits, bounding the size of
+# the projectile x troop distance matrices
+PROJECTILE_HIT_TILE = 4096
+
+# Positions are sent as uint16 fractions of the map size
+POSITION_SCALE = 65535.0
+
+# Quadtree node capacity and depth limit for archer target search
+QUADTREE_NODE_CAPACITY = 32
+QUADTREE_MAX_DEPTH = 16
+
+# Troop type ids, indexing TROOP_TYPES
+SOLDIER = 0
+KNIGHT = 1
+ARCHER = 2
+TROOP_TYPES = ('soldier', 'knight', 'archer')
+
+# Troop flag bits
+IS_ATTACKING = 1
+
+# Per-type unit stats, indexed by troop type id
+UNIT_SPEED = np.array([40.0, 0.0, 30.0], dtype=np.float32)  # Starting speed
+UNIT_ATTACK = np.array([15.0, 0.0, 20.0], dtype=np.float32)  # Knight attack is modified by speed
+UNIT_ATTACK_RANGE = np.array([15.0, 0.0, 0.0], dtype=np.float32)  # Soldier melee range
+UNIT_ATTACK_RATE = np.array([1.0, 0.0, 0.5], dtype=np.float32)  # Attacks per second
+UNIT_WEIGHT = np.array([1.0, 2.0, 1.0], dtype=np.float32)  # Knights are heavier
+
+# Unit-specific stats
+SOLDIER_ATTACK_SPEED = 30.0  # Reduced speed while attacking
+KNIGHT_MAX_SPEED = 80.0  # Maximum speed
+KNIGHT_ACCELERATION = 20.0  # Units per second^2
+ARCHER_MIN_RANGE = 50.0  # Minimum attack range
+ARCHER_MAX_RANGE = 200.0  # Maximum attack range
+
+# Explicit collision kernel signature, so it is compiled (or loaded from the
+# on-disk cache) eagerly at import instead of on the first game tick
+_COLLIDE_SIGNATURE = (
+    'Tuple((f4[::1], f4[::1], b1[::1]))('
+    'f4[:, ::1], f4[:, ::1], b1[::1], u1[::1], i4[::1], f4[::1], f4[::1], f4[::1], '
+    'f4[::1], f4[::1], f8, f8, f8, i4[::1], i4[::1], i4[::1], i8, i8, i8)'
+)
+
+@njit(_COLLIDE_SIGNATURE, cache=True, nogil=True, fastmath=True, boundscheck=False)
+def _collide_kernel(pos, dir_, alive, type_id, player_id, attack, attack_range, cooldown,
+                    attack_rate, weight, map_w, map_h, dt, cell_start, cell_count, cell_idx,
+                    cells_x, cells_y, cell_size):
+    """Resolve melee collisions between troops of different players.
+    
+    Candidates come from the CSR spatial grid (cell_start, cell_count,
+    cell_idx), which only holds live rows. Directions and cooldowns are updated
+    in place; returns per-troop damage taken, total colliding weight and
+    whether the troop is attacking.
+    """
+    n = pos.shape[0]
+    damage = np.zeros(n, dtype=np.float32)
+    colliding_weight = np.zeros(n, dtype=np.float32)
+    attacking = np.zeros(n, dtype=np.bool_)
+    inv_map_w = 1.0 / map_w
+    inv_map_h = 1.0 / map_h
+    
+    # Visit the 3x3 block of neighbour cells, or every cell on tiny grids
+    x_lo, x_hi = (-1, 2) if cells_x >= 3 else (0, cells_x)
+    y_lo, y_hi = (-1, 2) if cells_y >= 3 else (0, cells_y)
+    
+    for i in range(n):
+        if not alive[i]:
+            continue
+        x1 = pos[i, 0]
+        y1 = pos[i, 1]
+        type1 = type_id[i]
+        player1 = player_id[i]
+        cx = int(x1 // cell_size) if cells_x >= 3 else 0
+        cy = int(y1 // cell_size) if cells_y >= 3 else 0
+        
+        for ox in range(x_lo, x_hi):
+            for oy in range(y_lo, y_hi):
+                cell = ((cy + oy) % cells_y) * cells_x + (cx + ox) % cells_x
+                start = cell_start[cell]
+                for k in range(start, start + cell_count[cell]):
+                    j = cell_idx[k]
+                    
+                    # Skip if same troop or troops belong to the same player
+                    if i == j or player1 == player_id[j]:
+                        continue
+                    
+                    # Calculate wrapped distance between troops
+                    dx = x1 - pos[j, 0]
+                    dy = y1 - pos[j, 1]
+                    dx -= map_w * round(dx * inv_map_w)
+                    dy -= map_h * round(dy * inv_map_h)
+                    d2 = dx*dx + dy*dy
+                    
+                    # Collision detection, on squared distances
+                    if d2 >= 225:  # Collision radius of 15
+                        continue
+                    
+                    # Handle soldier attacks
+                    if type1 == 0:
+                        reach = attack_range[type1]
+                        if d2 <= reach * reach:
+                            attacking[i] = True
+                            
+                            # Attack if cooldown is ready
+                            if cooldown[i] <= 0:
+                                damage[j] += attack[i]
+                                cooldown[i] = 1.0 / attack_rate[type1]
+                    
+                    # Knights do damage proportional to their speed
+                    elif type1 == 1:
+                        damage[j] += attack[i] * dt
+                        colliding_weight[i] += weight[type_id[j]]
+                    
+                    # Archers take more damage in melee
+                    else:
+                        damage[i] += attack[j] * 1.5 * dt
+                    
+                    # Troops bounce off each other
+                    if d2 > 0:
+                        # Normalized direction vector from troop j to troop i
+                        inv = 1.0 / math.sqrt(d2)
+                        nx = dx * inv
+                        ny = dy * inv
+                        
+                        dx1 = nx * 0.5 + dir_[i, 0] * 0.5
+                        dy1 = ny * 0.5 + dir_[i, 1] * 0.5
+                        norm1 = math.hypot(dx1, dy1)
+                        if norm1 > 0:
+                            dx1 /= norm1
+                            dy1 /= norm1
+                        dir_[i, 0] = dx1
+                        dir_[i, 1] = dy1
+                        
+                        dx2 = -nx * 0.5 + dir_[j, 0] * 0.5
+                        dy2 = -ny * 0.5 + dir_[j, 1] * 0.5
+                        norm2 = math.hypot(dx2, dy2)
+                        if norm2 > 0:
+                            dx2 /= norm2
+                            dy2 /= norm2
+                        dir_[j, 0] = dx2
+                        dir_[j, 1] = dy2
+    
+    return damage, colliding_weight, attacking
+
+def _pack(arr, dtype):
+    """Convert an array to a contiguous array of the dtype sent to clients"""
+    return np.ascontiguousarray(arr, dtype=dtype)
+
+def warm_up_kernels():
+    """Run one collision pass at startup so the first game tick doesn't stall"""
+    state = GameState()
+    player_id = state.add_player(None)
+    state.spawn_troops(player_id, (0, 0), (1, 0), count=2, unit_type='archer')
+    state.process_collisions(0.0)
+
+class QuadTree:
+    """Point quadtree used to find archer targets within range.
+    
+    Each node holds up to capacity points before splitting into four
+    children; points are stored as (x, y, payload) tuples. Trees are built
+    in bulk with from_points.
+    """
+    def __init__(self, x, y, width, height, capacity=QUADTREE_NODE_CAPACITY, depth=0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.depth = depth
+        self.points = []
+        self.children = None
+    
+    @classmethod
+    def from_points(cls, x, y, width, height, points, payloads,
+                    capacity=QUADTREE_NODE_CAPACITY, depth=0):
+        """Build a tree in one pass from an (n, 2) array of points and matching payloads.
+        
+        Points are partitioned by quadrant with array masks, so no point is
+        inserted one at a time; points on the max edges land in the last child.
+        """
+        node = cls(x, y, width, height, capacity, depth)
+        if len(points) > capacity and depth < QUADTREE_MAX_DEPTH:
+            half_w = width / 2
+            half_h = height / 2
+            index = (points[:, 0] >= x + half_w) + 2 * (points[:, 1] >= y + half_h)
+            node.children = []
+            for k in range(4):
+                mask = index == k
+                node.children.append(cls.from_points(
+                    x + half_w * (k & 1), y + half_h * (k >> 1), half_w, half_h,
+                    points[mask], payloads[mask], capacity, depth + 1))
+        else:
+            node.points = [(px, py, payload) for (px, py), payload
+                           in zip(points.tolist(), payloads.tolist())]
+        return node
+    
+    def query_circle(self, cx, cy, r):
+        """Yield the payloads of all points within distance r of (cx, cy).
+        
+        Results are produced lazily, so a caller that stops at the first
+        match doesn't pay for the rest of the traversal.
+        """
+        r2 = r * r
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            # Skip nodes whose bounds don't touch the circle
+            nearest_x = min(max(cx, node.x), node.x + node.width)
+            nearest_y = min(max(cy, node.y), node.y + node.height)
+            if (nearest_x - cx) ** 2 + (nearest_y - cy) ** 2 > r2:
+                continue
+            
+            if node.children is not None:
+                stack.extend(node.children)
+                continue
+            
+            for px, py, payload in node.points:
+                if (px - cx) ** 2 + (py - cy) ** 2 <= r2:
+                    yield payload
+
+class TroopSOA:
+    """Struct-of-arrays storage for all troops in the game.
+    
+    Troops occupy rows [0, count) of every array, with the alive mask marking
+    which of those rows hold live troops. Dead rows go on a free list for the
+    next spawn and are only compacted away once they make up more than
+    COMPACT_DEAD_FRACTION of the rows. Arrays are preallocated and their
+    capacity is doubled on demand.
+    """
+    FIELDS = ('id', 'pos', 'dir', 'speed', 'health', 'attack', 'cooldown',
+              'type_id', 'player_id', 'flags', 'alive')
+    
+    def __init__(self, capacity=1024):
+        self.count = 0  # Rows in use, live or dead
+        self.live_count = 0
+        self.capacity = capacity
+        self.free_rows = []  # Dead rows below count, reused by allocate
+        self._live_rows = None
+        self.id = np.zeros(capacity, dtype=np.int32)
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.dir = np.zeros((capacity, 2), dtype=np.float32)
+        self.speed = np.zeros(capacity, dtype=np.float32)
+        self.health = np.zeros(capacity, dtype=np.float32)
+        self.attack = np.zeros(capacity, dtype=np.float32)
+        self.cooldown = np.zeros(capacity, dtype=np.float32)  # Time until next attack
+        self.type_id = np.zeros(capacity, dtype=np.uint8)
+        self.player_id = np.zeros(capacity, dtype=np.int32)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.alive = np.zeros(capacity, dtype=np.bool_)
+    
+    def __len__(self):
+        return self.live_count
+    
+    def live_rows(self):
+        """Return the indices of live rows, cached until rows change"""
+        if self._live_rows is None:
+            self._live_rows = np.flatnonzero(self.alive[:self.count])
+        return self._live_rows
+    
+    def allocate(self, count):
+        """Reserve count zeroed live rows, reusing free rows first, and return their indices"""
+        if count < 0:
+            raise ValueError(f"Cannot allocate {count} rows")
+        reused = self.free_rows[max(0, len(self.free_rows) - count):]
+        del self.free_rows[len(self.free_rows) - len(reused):]
+        fresh = count - len(reused)
+        
+        needed = self.count + fresh
+        if needed > self.capacity:
+            capacity = self.capacity
+            while capacity < needed:
+                capacity *= 2
+            for name in self.FIELDS:
+                old = getattr(self, name)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.count] = old[:self.count]
+                setattr(self, name, new)
+            self.capacity = capacity
+        
+        rows = np.concatenate((np.array(reused, dtype=np.intp),
+                               np.arange(self.count, needed, dtype=np.intp)))
+        for name in self.FIELDS:
+            getattr(self, name)[rows] = 0
+        self.alive[rows] = True
+        self.count = needed
+        self.live_count += count
+        self._live_rows = None
+        return rows
+    
+    def kill(self, rows):
+        """Mark rows as dead and put them on the free list"""
+        rows = rows[self.alive[rows]]
+        if len(rows) == 0:
+            return
+        self.alive[rows] = False
+        self.live_count -= len(rows)
+        self.free_rows.extend(rows.tolist())
+        self._live_rows = None
+    
+    def compact(self):
+        """Squeeze out dead rows once they make up too much of the storage"""
+        dead = self.count - self.live_count
+        if dead == 0 or dead / self.count <= COMPACT_DEAD_FRACTION:
+            return
+        keep = self.live_rows()
+        for name in self.FIELDS:
+            arr = getattr(self, name)
+            arr[:self.live_count] = arr[keep]
+        self.count = self.live_count
+        self.free_rows = []
+        self._live_rows = None
+    
+    def static_fields(self, rows):
+        """Pack the static fields of the given rows as arrays for sending to clients"""
+        return {
+            'id': _pack(self.id[rows], '<i4'),
+            'player_id': _pack(self.player_id[rows], '<i4'),
+            'type_id': _pack(self.type_id[rows], 'u1'),
+        }
+
 # Game state
 class GameState:
+    PROJECTILE_FIELDS = ('proj_pos', 'proj_vel', 'proj_ttl', 'proj_damage', 'proj_player_id')
+    
     def __init__(self):
-        self.players = {}  # Map of player_id to player data
-        self.troops = []   # List of all troops in the game
+        self.players = {}  # Map of sid to player data
+        self._sid_by_pid = {}  # Map of player id to sid
+        self._player_by_pid = {}  # Map of player id to player data
+        self.troops = TroopSOA()  # Struct-of-arrays storage for all troops
         self.next_player_id = 1
         self.next_troop_id = 1
         self.map_size = (2000, 2000)  # Size of the game map
-        self.projectiles = []  # List of all projectiles (arrows) in the game
-        self.next_projectile_id = 1
+        self._map_size_arr = np.array(self.map_size, dtype=np.float32)
+        # Struct-of-arrays storage for all projectiles (arrows) in the game
+        self.proj_pos = np.zeros((0, 2), dtype=np.float32)
+        self.proj_vel = np.zeros((0, 2), dtype=np.float32)  # Direction scaled by speed
+        self.proj_ttl = np.zeros(0, dtype=np.float32)  # Seconds before the arrow disappears
+        self.proj_damage = np.zeros(0, dtype=np.float32)
+        self.proj_player_id = np.zeros(0, dtype=np.int32)
+        self._rng = np.random.default_rng()
+        self.tick = 0  # Number of delta updates published for clients
+        self.dirty_spawn_ids = set()  # Troops spawned since the last delta update
+        self.dirty_remove_ids = set()  # Troops removed since the last delta update
+        self.keyframe_requested = False  # Make the next published update a keyframe (sim thread only)
+        self._snapshots = [None, None]  # Double buffer of published (update, dev data) pairs
+        self._snapshot_index = 0  # Slot holding the latest published snapshot
         
     def add_player(self, sid):
         player_id = self.next_player_id
@@ -56,444 +421,542 @@ class GameState:
             'color': color,
             'troops': []
         }
+        self._sid_by_pid[player_id] = sid
+        self._player_by_pid[player_id] = self.players[sid]
         
         return player_id
     
     def remove_player(self, sid):
         if sid in self.players:
             # Remove all troops belonging to this player
-            self.troops = [t for t in self.troops if t['player_id'] != self.players[sid]['id']]
+            player_id = self.players[sid]['id']
+            troops = self.troops
+            self._kill_troops(np.flatnonzero(troops.player_id[:troops.count] == player_id))
             del self.players[sid]
+            del self._sid_by_pid[player_id]
+            del self._player_by_pid[player_id]
     
     def spawn_troops(self, player_id, position, direction, count=50, unit_type=None):
         """Spawn a group of troops for a player at the given position moving in the given direction"""
-        new_troops = []
-        player_data = None
-        
-        # Find the player data
-        for sid, data in self.players.items():
-            if data['id'] == player_id:
-                player_data = data
-                break
-        
+        player_data = self._player_by_pid.get(player_id)
         if player_data is None:
             return []
         
+        # The count comes from the client, so only accept a positive int
+        if not isinstance(count, int) or isinstance(count, bool) or count <= 0:
+            return []
+        
         # Normalize direction vector
-        direction_norm = np.linalg.norm(direction)
+        direction_norm = math.hypot(direction[0], direction[1])
         if direction_norm > 0:
             direction = (direction[0] / direction_norm, direction[1] / direction_norm)
         
         # If no unit type specified, randomly distribute between the three types
         if unit_type is None:
-            unit_types = ['soldier', 'knight', 'archer']
-            unit_type = np.random.choice(unit_types)
+            unit_type = TROOP_TYPES[self._rng.integers(len(TROOP_TYPES))]
+        if unit_type not in TROOP_TYPES:
+            return []
+        type_id = TROOP_TYPES.index(unit_type)
+        
+        # Base troop properties
+        troops = self.troops
+        rows = troops.allocate(count)
+        troops.id[rows] = np.arange(self.next_troop_id, self.next_troop_id + count)
+        troops.player_id[rows] = player_id
+        troops.type_id[rows] = type_id
+        troops.health[rows] = 100
+        troops.speed[rows] = UNIT_SPEED[type_id]
+        troops.attack[rows] = UNIT_ATTACK[type_id]
+        self.next_troop_id += count
+        self.dirty_spawn_ids.update(troops.id[rows].tolist())
         
         # Create troops in a small cluster around the position
-        for _ in range(count):
-            # Add some random offset to position
-            offset = (np.random.normal(0, 20), np.random.normal(0, 20))
-            troop_pos = (position[0] + offset[0], position[1] + offset[1])
-            
-            # Add some randomness to direction
-            dir_offset = (np.random.normal(0, 0.1), np.random.normal(0, 0.1))
-            troop_dir = (direction[0] + dir_offset[0], direction[1] + dir_offset[1])
-            
-            # Normalize direction again
-            dir_norm = np.linalg.norm(troop_dir)
-            if dir_norm > 0:
-                troop_dir = (troop_dir[0] / dir_norm, troop_dir[1] / dir_norm)
-            
-            # Base troop properties
-            troop = {
-                'id': self.next_troop_id,
-                'player_id': player_id,
-                'position': troop_pos,
-                'direction': troop_dir,
-                'health': 100,
-                'color': player_data['color'],
-                'type': unit_type,
-                'is_attacking': False,
-                'target': None,
-                'weight': 1.0,  # Base weight for collision calculations
-            }
-            
-            # Set unit-specific properties
-            if unit_type == 'soldier':
-                troop.update({
-                    'speed': 40.0,  # Standard speed
-                    'attack_speed': 30.0,  # Reduced speed while attacking
-                    'attack': 15.0,
-                    'attack_range': 15.0,  # Melee range
-                    'shape': 'circle',
-                    'attack_cooldown': 0.0,  # Time until next attack
-                    'attack_rate': 1.0,  # Attacks per second
-                })
-            elif unit_type == 'knight':
-                troop.update({
-                    'speed': 0.0,  # Current speed
-                    'max_speed': 80.0,  # Maximum speed
-                    'acceleration': 20.0,  # Units per second^2
-                    'attack': 0.0,  # Base attack (will be modified by speed)
-                    'shape': 'triangle',
-                    'weight': 2.0,  # Knights are heavier
-                })
-            elif unit_type == 'archer':
-                troop.update({
-                    'speed': 30.0,  # Slower than soldier
-                    'attack': 20.0,
-                    'min_range': 50.0,  # Minimum attack range
-                    'max_range': 200.0,  # Maximum attack range
-                    'shape': 'square',
-                    'attack_cooldown': 0.0,
-                    'attack_rate': 0.5,  # Slower attack rate than soldier
-                })
-            
-            self.next_troop_id += 1
-            new_troops.append(troop)
+        offsets = self._rng.normal(0, 20, (count, 2))
+        troops.pos[rows] = (np.asarray(position) + offsets) % self._map_size_arr
+        
+        # Add some randomness to direction
+        dir_offsets = self._rng.normal(0, 0.1, (count, 2))
+        troop_dirs = np.asarray(direction) + dir_offsets
+        
+        # Normalize directions again
+        norms = np.hypot(troop_dirs[:, 0], troop_dirs[:, 1])[:, None]
+        troop_dirs /= np.where(norms > 0, norms, 1)
+        troops.dir[rows] = troop_dirs
         
-        self.troops.extend(new_troops)
-        return new_troops
+        return troops.id[rows].tolist()
     
     def update(self, dt):
         """Update the game state for a time step dt (in seconds)"""
         # Update projectiles
         self.update_projectiles(dt)
         
-        # Update troops based on their type
-        for troop in self.troops:
-            if troop['type'] == 'soldier':
-                self.update_soldier(troop, dt)
-            elif troop['type'] == 'knight':
-                self.update_knight(troop, dt)
-            elif troop['type'] == 'archer':
-                self.update_archer(troop, dt)
-            
-            # Implement screen wrapping for troops
-            troop['position'] = (
-                troop['position'][0] % self.map_size[0],
-                troop['position'][1] % self.map_size[1]
-            )
+        # Update troop speeds and cooldowns based on their type
+        troops = self.troops
+        n = troops.count
+        type_id = troops.type_id[:n]
+        speed = troops.speed[:n]
+        cooldown = troops.cooldown[:n]
+        soldiers = type_id == SOLDIER
+        knights = type_id == KNIGHT
+        attacking = (troops.flags[:n] & IS_ATTACKING) != 0
+        
+        # Soldiers move at reduced speed while attacking; knights accelerate
+        # over time and their attack is proportional to their speed
+        speed[soldiers] = np.where(attacking[soldiers], SOLDIER_ATTACK_SPEED, UNIT_SPEED[SOLDIER])
+        speed[knights] = np.minimum(speed[knights] + KNIGHT_ACCELERATION * dt, KNIGHT_MAX_SPEED)
+        troops.attack[:n][knights] = speed[knights] / 10.0
+        
+        # Decrement attack cooldowns of archers and attacking soldiers
+        cooldown[(cooldown > 0) & ((type_id == ARCHER) | (soldiers & attacking))] -= dt
+        
+        # Update positions based on direction and speed, with screen wrapping,
+        # in a single pass over the position array
+        pos = troops.pos[:n]
+        np.add(pos, troops.dir[:n] * speed[:, None] * dt, out=pos)
+        np.mod(pos, self._map_size_arr, out=pos)
         
         # Process collisions and combat
         self.process_collisions(dt)
         
         # Remove dead troops
-        self.troops = [t for t in self.troops if t['health'] > 0]
+        n = troops.count
+        self._kill_troops(np.flatnonzero(troops.alive[:n] & (troops.health[:n] <= 0)))
+        troops.compact()
         
         # Remove expired projectiles
-        self.projectiles = [p for p in self.projectiles if p['time_to_live'] > 0]
-    
-    def update_soldier(self, soldier, dt):
-        """Update a soldier unit"""
-        # Soldiers can attack while standing still or move at reduced speed while attacking
-        if soldier['is_attacking'] and soldier['target'] is not None:
-            # Move at reduced speed while attacking
-            soldier['speed'] = soldier['attack_speed']
-            
-            # Decrement attack cooldown
-            if soldier['attack_cooldown'] > 0:
-                soldier['attack_cooldown'] -= dt
-        else:
-            # Reset to normal speed when not attacking
-            soldier['speed'] = 40.0
-            soldier['is_attacking'] = False
-            soldier['target'] = None
-        
-        # Update position based on direction and speed
-        soldier['position'] = (
-            soldier['position'][0] + soldier['direction'][0] * soldier['speed'] * dt,
-            soldier['position'][1] + soldier['direction'][1] * soldier['speed'] * dt
-        )
+        alive = self.proj_ttl > 0
+        if not alive.all():
+            for name in self.PROJECTILE_FIELDS:
+                setattr(self, name, getattr(self, name)[alive])
     
-    def update_knight(self, knight, dt):
-        """Update a knight unit"""
-        # Knights accelerate over time
-        if knight['speed'] < knight['max_speed']:
-            knight['speed'] += knight['acceleration'] * dt
-            if knight['speed'] > knight['max_speed']:
-                knight['speed'] = knight['max_speed']
-        
-        # Update position based on direction and speed
-        knight['position'] = (
-            knight['position'][0] + knight['direction'][0] * knight['speed'] * dt,
-            knight['position'][1] + knight['direction'][1] * knight['speed'] * dt
-        )
+    def _kill_troops(self, rows):
+        """Remove troops by row, recording their ids for the next delta update"""
+        troops = self.troops
+        rows = rows[troops.alive[rows]]
+        ids = set(troops.id[rows].tolist())
         
-        # Knight's attack is proportional to its speed
-        knight['attack'] = knight['speed'] / 10.0
-    
-    def update_archer(self, archer, dt):
-        """Update an archer unit"""
-        # Update position based on direction and speed
-        archer['position'] = (
-            archer['position'][0] + archer['direction'][0] * archer['speed'] * dt,
-            archer['position'][1] + archer['direction'][1] * archer['speed'] * dt
-        )
-        
-        # Decrement attack cooldown
-        if archer['attack_cooldown'] > 0:
-            archer['attack_cooldown'] -= dt
+        # Troops that never reached clients don't need a remove entry
+        self.dirty_remove_ids |= ids - self.dirty_spawn_ids
+        self.dirty_spawn_ids -= ids
+        troops.kill(rows)
     
     def update_projectiles(self, dt):
         """Update all projectiles"""
-        for projectile in self.projectiles:
-            # Update position
-            projectile['position'] = (
-                projectile['position'][0] + projectile['direction'][0] * projectile['speed'] * dt,
-                projectile['position'][1] + projectile['direction'][1] * projectile['speed'] * dt
-            )
-            
-            # Implement screen wrapping for projectiles
-            projectile['position'] = (
-                projectile['position'][0] % self.map_size[0],
-                projectile['position'][1] % self.map_size[1]
-            )
-            
-            # Decrease time to live
-            projectile['time_to_live'] -= dt
+        # Update positions with screen wrapping and decrease time to live
+        np.add(self.proj_pos, self.proj_vel * dt, out=self.proj_pos)
+        np.mod(self.proj_pos, self._map_size_arr, out=self.proj_pos)
+        self.proj_ttl -= dt
+    
+    def _build_grid(self, cell_size):
+        """Bucket troop rows into a uniform spatial hash grid in CSR form.
+        
+        Cells are taken modulo the number of cells across the map, so neighbour
+        lookups wrap around the map edges for free. Rows in cell c are
+        cell_idx[cell_start[c]:cell_start[c] + cell_count[c]].
+        """
+        cells_x = max(1, int(self.map_size[0] // cell_size))
+        cells_y = max(1, int(self.map_size[1] // cell_size))
+        rows = self.troops.live_rows()
+        cells = (self.troops.pos[rows] // cell_size).astype(np.int64)
+        cells %= (cells_x, cells_y)
+        cell = cells[:, 1] * cells_x + cells[:, 0]
+        
+        cell_idx = rows[np.argsort(cell, kind='stable')].astype(np.int32)
+        cell_count = np.bincount(cell, minlength=cells_x * cells_y).astype(np.int32)
+        cell_start = (np.cumsum(cell_count) - cell_count).astype(np.int32)
+        return cell_start, cell_count, cell_idx, cells_x, cells_y
+    
+    def _build_quadtrees(self):
+        """Build one quadtree per player over their live troop positions, with rows as payloads"""
+        map_w, map_h = float(self.map_size[0]), float(self.map_size[1])
+        troops = self.troops
+        rows = troops.live_rows()
+        owners = troops.player_id[rows]
+        trees = {}
+        for owner in np.unique(owners).tolist():
+            owned = rows[owners == owner]
+            trees[owner] = QuadTree.from_points(0.0, 0.0, map_w, map_h, troops.pos[owned], owned)
+        return trees
+    
+    def _query_wrapped(self, tree, cx, cy, r):
+        """Yield payloads in a circle, repeating the query across map edges it overlaps"""
+        map_w, map_h = self.map_size
+        offsets_x = [0.0]
+        if cx - r < 0:
+            offsets_x.append(map_w)
+        if cx + r >= map_w:
+            offsets_x.append(-map_w)
+        offsets_y = [0.0]
+        if cy - r < 0:
+            offsets_y.append(map_h)
+        if cy + r >= map_h:
+            offsets_y.append(-map_h)
+        
+        for ox in offsets_x:
+            for oy in offsets_y:
+                yield from tree.query_circle(cx + ox, cy + oy, r)
     
     def process_collisions(self, dt):
         """Process collisions between troops and projectiles"""
+        troops = self.troops
+        n = troops.count
+        pos = troops.pos
+        dir_ = troops.dir
+        health = troops.health
+        type_id = troops.type_id
+        player_id = troops.player_id
+        cooldown = troops.cooldown
+        
+        # Bucket troops once per tick into a grid sized to the collision radius
+        melee_grid = self._build_grid(MELEE_CELL_SIZE)
+        map_w, map_h = float(self.map_size[0]), float(self.map_size[1])
+        inv_map_w, inv_map_h = 1.0 / map_w, 1.0 / map_h
+        
         # Check for collisions between troops of different players
-        for i, troop1 in enumerate(self.troops):
-            # Track total weight of colliding troops for knights
-            total_colliding_weight = 0.0
-            
-            for j, troop2 in enumerate(self.troops):
-                # Skip if same troop or troops belong to the same player
-                if i == j or troop1['player_id'] == troop2['player_id']:
-                    continue
-                
-                # Calculate wrapped distance between troops
-                dx = troop1['position'][0] - troop2['position'][0]
-                dy = troop1['position'][1] - troop2['position'][1]
-                
-                # Adjust for screen wrapping
-                if abs(dx) > self.map_size[0] / 2:
-                    dx = self.map_size[0] - abs(dx)
-                    if troop1['position'][0] < troop2['position'][0]:
-                        dx = -dx
-                
-                if abs(dy) > self.map_size[1] / 2:
-                    dy = self.map_size[1] - abs(dy)
-                    if troop1['position'][1] < troop2['position'][1]:
-                        dy = -dy
-                
-                distance = np.sqrt(dx*dx + dy*dy)
+        damage, colliding_weight, attacking = _collide_kernel(
+            pos[:n], dir_[:n], troops.alive[:n], type_id[:n], player_id[:n],
+            troops.attack[:n], UNIT_ATTACK_RANGE, cooldown[:n], UNIT_ATTACK_RATE,
+            UNIT_WEIGHT, map_w, map_h, dt, *melee_grid, MELEE_CELL_SIZE)
+        health[:n] -= damage
+        troops.flags[:n][attacking] |= IS_ATTACKING
+        
+        # Apply collision weight penalty to knights
+        speed = troops.speed[:n]
+        np.maximum(speed - colliding_weight * 10.0 * dt, 0, out=speed)
+        
+        # Handle archer ranged attacks against troops outside melee range
+        archers = np.flatnonzero(troops.alive[:n] & (type_id[:n] == ARCHER) &
+                                 (cooldown[:n] <= 0))
+        if len(archers) > 0:
+            trees = self._build_quadtrees()
+            query = self._query_wrapped
+            positions = pos[:n].tolist()
+            owners = player_id[:n].tolist()
+            reload_time = 1.0 / float(UNIT_ATTACK_RATE[ARCHER])
+            min_range2 = ARCHER_MIN_RANGE * ARCHER_MIN_RANGE
+            max_range2 = ARCHER_MAX_RANGE * ARCHER_MAX_RANGE
+            shooters, targets = [], []
+            for i in archers.tolist():
+                x1, y1 = positions[i]
+                owner = owners[i]
                 
-                # Collision detection
-                if distance < 15:  # Collision radius
-                    # Handle soldier attacks
-                    if troop1['type'] == 'soldier':
-                        if distance <= troop1['attack_range']:
-                            troop1['is_attacking'] = True
-                            troop1['target'] = troop2['id']
-                            
-                            # Attack if cooldown is ready
-                            if troop1['attack_cooldown'] <= 0:
-                                troop2['health'] -= troop1['attack']
-                                troop1['attack_cooldown'] = 1.0 / troop1['attack_rate']
+                # Only search enemy players' trees, stopping at the first target
+                enemies = (j for pid, tree in trees.items() if pid != owner
+                           for j in query(tree, x1, y1, ARCHER_MAX_RANGE))
+                for j in enemies:
+                    x2, y2 = positions[j]
+                    dx = x1 - x2
+                    dy = y1 - y2
+                    dx -= map_w * round(dx * inv_map_w)
+                    dy -= map_h * round(dy * inv_map_h)
+                    d2 = dx*dx + dy*dy
                     
-                    # Handle knight attacks - damage based on speed
-                    if troop1['type'] == 'knight':
-                        # Knights do damage proportional to their speed
-                        troop2['health'] -= troop1['attack'] * dt
-                        
-                        # Add to total colliding weight
-                        total_colliding_weight += troop2['weight']
-                    
-                    # Handle archer melee defense (archers are weak in close combat)
-                    if troop1['type'] == 'archer':
-                        # Archers take more damage in melee
-                        troop1['health'] -= troop2['attack'] * 1.5 * dt
-                    
-                    # Troops bounce off each other
-                    if distance > 0:
-                        # Normalized direction vector from troop2 to troop1
-                        nx = dx / distance
-                        ny = dy / distance
-                        
-                        # Update directions to bounce away
-                        troop1['direction'] = (nx * 0.5 + troop1['direction'][0] * 0.5, 
-                                              ny * 0.5 + troop1['direction'][1] * 0.5)
-                        troop2['direction'] = (-nx * 0.5 + troop2['direction'][0] * 0.5, 
-                                              -ny * 0.5 + troop2['direction'][1] * 0.5)
-                        
-                        # Normalize directions
-                        dir1_norm = np.linalg.norm(troop1['direction'])
-                        if dir1_norm > 0:
-                            troop1['direction'] = (troop1['direction'][0] / dir1_norm, 
-                                                 troop1['direction'][1] / dir1_norm)
-                        
-                        dir2_norm = np.linalg.norm(troop2['direction'])
-                        if dir2_norm > 0:
-                            troop2['direction'] = (troop2['direction'][0] / dir2_norm, 
-                                                 troop2['direction'][1] / dir2_norm)
-                
-                # Handle archer ranged attacks
-                elif troop1['type'] == 'archer':
-                    if (distance >= troop1['min_range'] and 
-                        distance <= troop1['max_range'] and 
-                        troop1['attack_cooldown'] <= 0):
-                        
-                        # Fire an arrow
-                        self.fire_arrow(troop1, troop2)
-                        troop1['attack_cooldown'] = 1.0 / troop1['attack_rate']
+                    if min_range2 <= d2 <= max_range2:
+                        shooters.append(i)
+                        targets.append(j)
+                        cooldown[i] = reload_time
+                        break
             
-            # Apply collision weight penalty to knights
-            if troop1['type'] == 'knight' and total_colliding_weight > 0:
-                # Reduce knight's speed based on total colliding weight
-                speed_reduction = total_colliding_weight * 10.0 * dt
-                troop1['speed'] = max(0, troop1['speed'] - speed_reduction)
+            # Fire all arrows for this tick at once
+            self.fire_arrows(np.array(shooters, dtype=np.intp), np.array(targets, dtype=np.intp))
         
         # Check for projectile hits
-        for projectile in list(self.projectiles):
-            if projectile['time_to_live'] <= 0:
-                continue
-                
-            for troop in self.troops:
-                # Skip if projectile belongs to the same player
-                if projectile['player_id'] == troop['player_id']:
-                    continue
-                
-                # Calculate wrapped distance
-                dx = projectile['position'][0] - troop['position'][0]
-                dy = projectile['position'][1] - troop['position'][1]
-                
-                # Adjust for screen wrapping
-                if abs(dx) > self.map_size[0] / 2:
-                    dx = self.map_size[0] - abs(dx)
-                    if projectile['position'][0] < troop['position'][0]:
-                        dx = -dx
-                
-                if abs(dy) > self.map_size[1] / 2:
-                    dy = self.map_size[1] - abs(dy)
-                    if projectile['position'][1] < troop['position'][1]:
-                        dy = -dy
-                
-                distance = np.sqrt(dx*dx + dy*dy)
-                
-                # Check for hit
-                if distance < 10:  # Projectile hit radius
-                    # Apply damage
-                    troop['health'] -= projectile['damage']
-                    
-                    # Apply knockback
-                    if distance > 0:
-                        # Normalized direction vector from projectile to troop
-                        nx = dx / distance
-                        ny = dy / distance
-                        
-                        # Apply knockback force
-                        knockback = 20.0  # Knockback strength
-                        troop['direction'] = (
-                            -nx * knockback + troop['direction'][0],
-                            -ny * knockback + troop['direction'][1]
-                        )
-                        
-                        # Normalize direction
-                        dir_norm = np.linalg.norm(troop['direction'])
-                        if dir_norm > 0:
-                            troop['direction'] = (
-                                troop['direction'][0] / dir_norm,
-                                troop['direction'][1] / dir_norm
-                            )
-                    
-                    # Remove the projectile
-                    projectile['time_to_live'] = 0
-                    break
+        self.process_projectile_hits()
+    
+    def process_projectile_hits(self):
+        """Apply damage and knockback from projectiles that hit an enemy troop"""
+        troops = self.troops
+        live = troops.live_rows()
+        n = len(live)
+        pos = troops.pos[live]
+        troop_player = troops.player_id[live]
+        map_w, map_h = self.map_size
+        inv_map_w, inv_map_h = 1.0 / map_w, 1.0 / map_h
+        
+        proj_count = len(self.proj_ttl)
+        hit_troop = np.full(proj_count, -1, dtype=np.intp)
+        hit_dx = np.zeros(proj_count, dtype=np.float32)
+        hit_dy = np.zeros(proj_count, dtype=np.float32)
+        flying = self.proj_ttl > 0
+        
+        # Each projectile hits the first enemy troop within range; walk the
+        # troops in tiles so the distance matrices stay small
+        for start in range(0, n, PROJECTILE_HIT_TILE):
+            pending = np.flatnonzero(flying & (hit_troop < 0))
+            if len(pending) == 0:
+                break
+            stop = min(start + PROJECTILE_HIT_TILE, n)
+            
+            # Calculate wrapped distances for every projectile/troop pair
+            dx = self.proj_pos[pending, None, 0] - pos[None, start:stop, 0]
+            dy = self.proj_pos[pending, None, 1] - pos[None, start:stop, 1]
+            dx -= map_w * np.round(dx * inv_map_w)
+            dy -= map_h * np.round(dy * inv_map_h)
+            
+            # Skip troops belonging to the projectile's player
+            hits = ((dx*dx + dy*dy < 100) &  # Projectile hit radius of 10
+                    (self.proj_player_id[pending, None] != troop_player[None, start:stop]))
+            
+            first = hits.argmax(axis=1)
+            found = hits[np.arange(len(pending)), first]
+            rows = pending[found]
+            cols = first[found]
+            hit_troop[rows] = start + cols
+            hit_dx[rows] = dx[found, cols]
+            hit_dy[rows] = dy[found, cols]
+        
+        hit_proj = np.flatnonzero(hit_troop >= 0)
+        if len(hit_proj) == 0:
+            return
+        hit_troop = live[hit_troop[hit_proj]]
+        
+        # Apply damage
+        np.add.at(troops.health, hit_troop, -self.proj_damage[hit_proj])
+        
+        # Apply knockback away from the projectile, summed over all hits
+        dx = hit_dx[hit_proj]
+        dy = hit_dy[hit_proj]
+        distance = np.hypot(dx, dy)
+        scale = np.divide(20.0, distance, out=np.zeros_like(distance), where=distance > 0)  # Knockback strength
+        knockback = np.zeros((troops.count, 2), dtype=np.float32)
+        np.add.at(knockback, hit_troop, -np.stack((dx, dy), axis=1) * scale[:, None])
+        
+        # Normalize directions of knocked back troops
+        knocked = np.unique(hit_troop)
+        directions = troops.dir[knocked] + knockback[knocked]
+        norms = np.hypot(directions[:, 0], directions[:, 1])
+        np.divide(directions, norms[:, None], out=directions, where=norms[:, None] > 0)
+        troops.dir[knocked] = directions
+        
+        # Remove the projectiles
+        self.proj_ttl[hit_proj] = 0
     
-    def fire_arrow(self, archer, target):
-        """Fire an arrow from an archer to a target"""
-        # Calculate wrapped direction to target
-        dx = target['position'][0] - archer['position'][0]
-        dy = target['position'][1] - archer['position'][1]
+    def fire_arrows(self, archers, targets):
+        """Fire one arrow from each archer row to the matching target row"""
+        troops = self.troops
+        pos = troops.pos
+        map_w, map_h = self.map_size
+        inv_map_w, inv_map_h = 1.0 / map_w, 1.0 / map_h
+        
+        # Calculate wrapped directions to targets
+        dx = pos[targets, 0] - pos[archers, 0]
+        dy = pos[targets, 1] - pos[archers, 1]
         
         # Adjust for screen wrapping
-        if abs(dx) > self.map_size[0] / 2:
-            dx = self.map_size[0] - abs(dx)
-            if archer['position'][0] < target['position'][0]:
-                dx = -dx
+        dx -= map_w * np.round(dx * inv_map_w)
+        dy -= map_h * np.round(dy * inv_map_h)
         
-        if abs(dy) > self.map_size[1] / 2:
-            dy = self.map_size[1] - abs(dy)
-            if archer['position'][1] < target['position'][1]:
-                dy = -dy
+        distance = np.hypot(dx, dy)
+        fired = distance > 0
+        archers = archers[fired]
+        count = len(archers)
+        if count == 0:
+            return
         
-        distance = np.sqrt(dx*dx + dy*dy)
+        # Create arrow projectiles
+        speed = 200.0  # Arrows are fast
+        new = {
+            'proj_pos': pos[archers],
+            'proj_vel': np.stack((dx[fired], dy[fired]), axis=1) * (speed / distance[fired, None]),
+            'proj_ttl': np.full(count, 2.0),  # Seconds before arrow disappears
+            'proj_damage': troops.attack[archers],
+            'proj_player_id': troops.player_id[archers],
+        }
+        for name in self.PROJECTILE_FIELDS:
+            old = getattr(self, name)
+            setattr(self, name, np.concatenate((old, np.asarray(new[name], dtype=old.dtype))))
+    
+    def move_troops(self, player_id, troop_ids, target_position):
+        """Point the player's listed troops toward the target position"""
+        troops = self.troops
+        n = troops.count
+        pos = troops.pos
+        rows = np.flatnonzero(troops.alive[:n] & np.isin(troops.id[:n], troop_ids) &
+                              (troops.player_id[:n] == player_id))
+        map_w, map_h = self.map_size
+        inv_map_w, inv_map_h = 1.0 / map_w, 1.0 / map_h
+        target_x, target_y = target_position[0], target_position[1]
         
-        if distance > 0:
-            direction = (dx / distance, dy / distance)
+        # Update direction for each troop to move toward the target position
+        for row, (x, y) in zip(rows.tolist(), pos[rows].tolist()):
+            # Calculate wrapped direction from troop to target
+            dx = target_x - x
+            dy = target_y - y
             
-            # Create arrow projectile
-            projectile = {
-                'id': self.next_projectile_id,
-                'player_id': archer['player_id'],
-                'position': archer['position'],
-                'direction': direction,
-                'speed': 200.0,  # Arrows are fast
-                'damage': archer['attack'],
-                'time_to_live': 2.0,  # Seconds before arrow disappears
-                'color': archer['color']
-            }
+            # Adjust for screen wrapping
+            dx -= map_w * round(dx * inv_map_w)
+            dy -= map_h * round(dy * inv_map_h)
             
-            self.next_projectile_id += 1
-            self.projectiles.append(projectile)
+            # Normalize direction
+            distance = math.hypot(dx, dy)
+            if distance > 0:
+                troops.dir[row] = (dx / distance, dy / distance)
+    
+    def to_delta(self, keyframe=False):
+        """Build the update sent to all clients and reset the dirty troop sets.
+        
+        Static troop fields are only sent for troops spawned since the last
+        update (or for every troop on a keyframe); positions, directions and
+        health of all troops are packed as quantized arrays alongside their ids.
+        """
+        spawned = self.dirty_spawn_ids
+        removed = self.dirty_remove_ids
+        self.dirty_spawn_ids = set()
+        self.dirty_remove_ids = set()
+        self.tick += 1
+        
+        if keyframe:
+            return self.to_keyframe()
+        troops = self.troops
+        rows = troops.live_rows()
+        added = rows[np.isin(troops.id[rows], list(spawned))]
+        return self._packed_state(added, list(removed), keyframe=False)
+    
+    def request_keyframe(self):
+        """Make the next published update a full keyframe"""
+        self.keyframe_requested = True
+    
+    def publish_snapshot(self, dev_data):
+        """Build the next client update into the spare snapshot slot and make it current"""
+        keyframe = self.keyframe_requested or self.tick % KEYFRAME_INTERVAL == 0
+        self.keyframe_requested = False
+        spare = 1 - self._snapshot_index
+        self._snapshots[spare] = (self.to_delta(keyframe), dev_data)
+        self._snapshot_index = spare
+    
+    def latest_snapshot(self):
+        """Return the latest published (update, dev data) pair, or None"""
+        return self._snapshots[self._snapshot_index]
     
-    def to_dict(self):
-        """Convert the game state to a dictionary for sending to clients"""
+    def to_keyframe(self):
+        """Build a full update carrying static fields for every troop"""
+        return self._packed_state(self.troops.live_rows(), [], keyframe=True)
+    
+    def _packed_state(self, added, removed, keyframe):
+        """Pack the current troop and projectile arrays into an update dict"""
+        troops = self.troops
+        rows = troops.live_rows()
+        pos_scale = POSITION_SCALE / self._map_size_arr
         return {
+            'tick': self.tick,
+            'keyframe': keyframe,
             'players': list(self.players.values()),
-            'troops': self.troops,
-            'projectiles': self.projectiles,
-            'map_size': self.map_size
+            'map_size': self.map_size,
+            'add': troops.static_fields(added),
+            'remove': _pack(removed, '<i4'),
+            'ids': _pack(troops.id[rows], '<i4'),
+            'pos': _pack(troops.pos[rows] * pos_scale, '<u2'),
+            'dir': _pack(np.round(troops.dir[rows] * 127), 'i1'),
+            'health': _pack(np.clip(np.ceil(troops.health[rows]), 0, 255), 'u1'),
+            'proj_player_id': _pack(self.proj_player_id, '<i4'),
+            'proj_pos': _pack(self.proj_pos * pos_scale, '<u2'),
         }
 
 # Create game state
 game_state = GameState()
 
+# The simulation steps on a single worker thread so physics doesn't compete
+# with the event loop; socket handlers queue their changes on the same
+# thread, which keeps them in order with the steps without any locking
+sim_executor = ThreadPoolExecutor(max_workers=1)
+
 # Game loop
-async def game_loop():
-    last_update = asyncio.get_event_loop().time()
+def build_dev_data(steps_per_second):
+    """Collect the stats shown in the client dev tools"""
+    troops = game_state.troops
+    troop_counts = np.bincount(troops.player_id[troops.live_rows()],
+                               minlength=game_state.next_player_id)
+    return {
+        'fps': steps_per_second,
+        'player_count': len(game_state.players),
+        'troop_count': len(troops),
+        'troops_by_player': {str(player_data['id']): int(troop_counts[player_data['id']])
+                            for player_data in game_state.players.values()}
+    }
+
+def publish_sim_snapshot(steps_per_second):
+    """Publish the next client update on the simulation thread"""
+    game_state.publish_snapshot(build_dev_data(steps_per_second))
+
+def connect_player(sid):
+    """Add a player on the simulation thread and make the next broadcast a keyframe.
+    
+    The new client is already in the broadcast room, so its first keyframe
+    goes out in stream order rather than racing later deltas.
+    """
+    player_id = game_state.add_player(sid)
+    game_state.request_keyframe()
+    return player_id
+
+async def run_on_sim(func, *args):
+    """Run func on the simulation thread, in order with the simulation steps"""
+    return await asyncio.get_event_loop().run_in_executor(sim_executor, func, *args)
+
+async def sim_loop():
+    """Advance the simulation in fixed steps and publish snapshots for broadcast"""
+    loop = asyncio.get_event_loop()
+    step_dt = 1 / SIM_TICK_RATE
+    publish_interval = 1 / BROADCAST_RATE
+    last_time = last_publish = loop.time()
+    accumulator = 0.0
+    steps = 0
     while True:
-        now = asyncio.get_event_loop().time()
-        dt = now - last_update
-        last_update = now
-        
-        # Update game state
-        game_state.update(dt)
-        
-        # Send game state to all clients
-        await sio.emit('game_state', game_state.to_dict())
-        
-        # Dev tools data
-        dev_data = {
-            'fps': 1/dt if dt > 0 else 0,
-            'player_count': len(game_state.players),
-            'troop_count': len(game_state.troops),
-            'troops_by_player': {player_data['id']: len([t for t in game_state.troops if t['player_id'] == player_data['id']]) 
-                                for _, player_data in game_state.players.items()}
-        }
-        await sio.emit('dev_data', dev_data)
+        now = loop.time()
+        accumulator = min(accumulator + now - last_time, MAX_SIM_STEPS * step_dt)
+        last_time = now
+        
+        # Run every fixed step that is due; queued handler changes run in between
+        while accumulator >= step_dt:
+            await loop.run_in_executor(sim_executor, game_state.update, step_dt)
+            accumulator -= step_dt
+            steps += 1
+        
+        # Publish a snapshot at the broadcast cadence so no delta is dropped
+        if now - last_publish >= publish_interval:
+            await loop.run_in_executor(sim_executor, publish_sim_snapshot,
+                                       steps / (now - last_publish))
+            last_publish = now
+            steps = 0
         
-        # Sleep to maintain target frame rate (30 FPS)
-        target_frame_time = 1/30
-        elapsed = asyncio.get_event_loop().time() - now
-        if elapsed < target_frame_time:
-            await asyncio.sleep(target_frame_time - elapsed)
+        # Sleep until the next step is due
+        await asyncio.sleep(max(0.0, step_dt - accumulator - (loop.time() - now)))
+
+async def broadcast_loop():
+    """Send the latest published snapshot to all clients at the broadcast rate"""
+    loop = asyncio.get_event_loop()
+    interval = 1 / BROADCAST_RATE
+    last_tick = None
+    while True:
+        start = loop.time()
+        snapshot = game_state.latest_snapshot()
+        if snapshot is not None and snapshot[0]['tick'] != last_tick:
+            update, dev_data = snapshot
+            
+            # A delta overwritten before it went out leaves clients missing
+            # spawns and removals, so resync them with a keyframe; the flag is
+            # only touched on the simulation thread, which also clears it
+            if last_tick is not None and update['tick'] != last_tick + 1 and not update['keyframe']:
+                await run_on_sim(game_state.request_keyframe)
+            last_tick = update['tick']
+            
+            await sio.emit('game_state', update)
+            await sio.emit('dev_data', dev_data)
+        
+        elapsed = loop.time() - start
+        if elapsed < interval:
+            await asyncio.sleep(interval - elapsed)
 
 # Socket.IO event handlers
 @sio.event
 async def connect(sid, environ):
     print(f"Client connected: {sid}")
-    player_id = game_state.add_player(sid)
+    player_id = await run_on_sim(connect_player, sid)
     await sio.emit('player_id', {'player_id': player_id}, room=sid)
 
 @sio.event
 async def disconnect(sid):
     print(f"Client disconnected: {sid}")
-    game_state.remove_player(sid)
+    await run_on_sim(game_state.remove_player, sid)
 
 @sio.event
 async def spawn_troops(sid, data):
@@ -504,7 +967,7 @@ async def spawn_troops(sid, data):
     unit_type = data.get('unit_type')  # Can be 'soldier', 'knight', 'archer', or None for random
     
     if position and direction:
-        game_state.spawn_troops(player_id, position, direction, count, unit_type)
+        await run_on_sim(game_state.spawn_troops, player_id, position, direction, count, unit_type)
 
 @sio.event
 async def move_troops(sid, data):
@@ -513,29 +976,7 @@ async def move_troops(sid, data):
     target_position = data.get('target_position')
     
     if troop_ids and target_position:
-        # Update direction for each troop to move toward the target position
-        for troop in game_state.troops:
-            if troop['id'] in troop_ids and troop['player_id'] == player_id:
-                # Calculate wrapped direction from troop to target
-                dx = target_position[0] - troop['position'][0]
-                dy = target_position[1] - troop['position'][1]
-                
-                # Adjust for screen wrapping
-                if abs(dx) > game_state.map_size[0] / 2:
-                    dx = game_state.map_size[0] - abs(dx)
-                    if troop['position'][0] < target_position[0]:
-                        dx = -dx
-                
-                if abs(dy) > game_state.map_size[1] / 2:
-                    dy = game_state.map_size[1] - abs(dy)
-                    if troop['position'][1] < target_position[1]:
-                        dy = -dy
-                
-                # Normalize direction
-                distance = (dx**2 + dy**2)**0.5
-                if distance > 0:
-                    direction = (dx / distance, dy / distance)
-                    troop['direction'] = direction
+        await run_on_sim(game_state.move_troops, player_id, troop_ids, target_position)
 
 # Serve static files
 import os
@@ -545,7 +986,9 @@ app.mount("/", StaticFiles(directory=client_dist_path, html=True), name="static"
 # Start game loop when the server starts
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(game_loop())
+    warm_up_kernels()
+    asyncio.create_task(sim_loop())
+    asyncio.create_task(broadcast_loop())
 
 # Run the server
 if __name__ == "__main__":